@@ -3,10 +3,13 @@ from dotenv import load_dotenv
 import os
 import random
 import html
+import atexit
 
 from utils.state_manager import ConversationState
 from utils.validators import Validators
 from utils.tech_stack_class import TechStackClassifier
+from utils.question_dedup import QuestionDeduplicator, dedup_question_output
+from utils.profile_archive import ProfileArchiveWriter
 from models.llm_interface import LLMInterface
 
 # Proper absolute path for .env loading
@@ -25,6 +28,58 @@ except FileNotFoundError:
     st.error("❌ Missing prompt files. Ensure prompts/ directory contains system_prompt.txt and questions.txt")
     st.stop()
 
+#  QUESTION DEDUPLICATION INDEX
+
+QUESTION_INDEX_PATH = os.path.join(BASE_DIR, "data", "question_index.bin")
+
+@st.cache_resource
+def load_question_index():
+    # One memory-mapped index per process, shared by every session
+    return QuestionDeduplicator(QUESTION_INDEX_PATH)
+
+def dedup_questions(raw_output):
+    """
+    Drop questions already served to earlier candidates, regenerating once
+    for technologies left with none. Any failure keeps the original output.
+    """
+    def regenerate(technologies):
+        retry_prompt = (
+            f"Candidate technologies: {', '.join(technologies)}\n\n{QUESTIONS_PROMPT}\n\n"
+            "Avoid the most common textbook questions; ask less usual, scenario-based ones."
+        )
+        return llm.generate_response(SYSTEM_PROMPT, retry_prompt)
+
+    try:
+        return dedup_question_output(load_question_index(), raw_output, regenerate)
+    except Exception:
+        # A broken index must never cost the candidate their questions
+        return raw_output
+
+#  COMPLETED PROFILE ARCHIVE
+
+PROFILE_ARCHIVE_PATH = os.path.join(BASE_DIR, "data", "profiles")
+
+@st.cache_resource
+def load_profile_archive():
+    # Small batches: this app finishes few interviews per minute, and the
+    # writer's background thread commits anything older than max_delay
+    writer = ProfileArchiveWriter(PROFILE_ARCHIVE_PATH, batch_size=16, max_delay=5.0)
+    atexit.register(writer.close)
+    return writer
+
+def archive_profile(state):
+    """
+    Archive the finished profile once per session.
+    A failure here must not break the conversation for the candidate.
+    """
+    if st.session_state.get("profile_archived"):
+        return
+    st.session_state.profile_archived = True
+    try:
+        load_profile_archive().append(state.collected_data)
+    except (OSError, ValueError):
+        pass
+
 #  LOAD CUSTOM CSS
 
 def load_css():
@@ -114,6 +169,9 @@ if user_input:
 
     # Global exit
     if state.detect_exit_intent(user_input):
+        # Leaving during final confirmation still completes the interview
+        if state.needs_final_confirmation():
+            archive_profile(state)
         bot_say("Thank you. Your information has been recorded. Have a great day!")
         st.stop()
 
@@ -123,9 +181,11 @@ if user_input:
         if lower in ["no", "none", "nothing", "nah", "nope"]:
             bot_say("Thank you for your time. We will contact you shortly.")
             state.is_complete = True
+            archive_profile(state)
             st.stop()
         else:
             state.store_response("additional_notes", user_input)
+            archive_profile(state)
             bot_say("Thanks for the additional details. We will contact you shortly.")
             st.stop()
 
@@ -173,6 +233,7 @@ if user_input:
 
             with st.spinner("Analyzing your profile…"):
                 questions = llm.generate_response(SYSTEM_PROMPT, user_prompt)
+                questions = dedup_questions(questions)
 
             bot_say("Here are some technical questions based on your background, please answer them carefully:")
             bot_say(questions)
@@ -0,0 +1,12 @@
+from utils.file_lock import file_lock
+
+
+def test_non_blocking_lock_fails_while_held(tmp_path):
+    path = str(tmp_path / "archive.lock")
+    with file_lock(path) as held:
+        assert held
+        with file_lock(path, blocking=False) as second:
+            assert not second
+
+    with file_lock(path, blocking=False) as held:
+        assert held
@@ -0,0 +1,140 @@
+import os
+import time
+
+import pytest
+
+from utils.profile_archive import ProfileArchiveReader, ProfileArchiveWriter
+
+
+ADA = {
+    "name": "Ada Lovelace",
+    "email": "ada@example.com",
+    "phone": "+441234567",
+    "experience_years": 2.5,
+    "desired_positions": ["Backend Developer"],
+    "location": "London",
+    "tech_stack": ["Python", "Django"],
+    "additional_notes": None,
+}
+GRACE = {
+    "name": "Grace Hopper",
+    "experience_years": None,
+    "desired_positions": ["Backend Developer", "AI Engineer"],
+    "tech_stack": ["Python", "Go", "Go"],
+}
+
+
+def _write(path, *profiles, **kwargs):
+    with ProfileArchiveWriter(str(path), max_delay=None, **kwargs) as writer:
+        for profile in profiles:
+            writer.append(profile)
+
+
+def test_count_by_and_projection(tmp_path):
+    _write(tmp_path, ADA, GRACE)
+
+    with ProfileArchiveReader(str(tmp_path)) as archive:
+        assert len(archive) == 2
+        # Duplicates inside one profile count once
+        assert archive.count_by("tech_stack") == {"Python": 2, "Django": 1, "Go": 1}
+        assert archive.count_by("desired_positions") == {"Backend Developer": 2, "AI Engineer": 1}
+        assert list(archive.iter_rows(["name", "experience_years"])) == [
+            {"name": "Ada Lovelace", "experience_years": 2.5},
+            {"name": "Grace Hopper", "experience_years": None},
+        ]
+        assert list(archive.iter_rows())[1]["location"] is None
+
+
+def test_projection_reads_only_requested_columns(tmp_path):
+    _write(tmp_path, ADA, GRACE)
+    for name in os.listdir(tmp_path):
+        if not name.startswith(("tech_stack.", "name.", "_commits")):
+            os.remove(os.path.join(tmp_path, name))
+
+    with ProfileArchiveReader(str(tmp_path)) as archive:
+        assert archive.count_by("tech_stack") == {"Python": 2, "Django": 1, "Go": 1}
+        assert [row["name"] for row in archive.iter_rows(["name"])] == ["Ada Lovelace", "Grace Hopper"]
+        with pytest.raises(FileNotFoundError):
+            list(archive.iter_rows(["location"]))
+
+
+def test_batches_are_only_visible_after_commit(tmp_path):
+    writer = ProfileArchiveWriter(str(tmp_path), batch_size=2, max_delay=None)
+    writer.append(ADA)
+    with ProfileArchiveReader(str(tmp_path)) as archive:
+        assert len(archive) == 0
+
+    writer.append(GRACE)
+    with ProfileArchiveReader(str(tmp_path)) as archive:
+        assert len(archive) == 2
+    writer.close()
+
+
+def test_background_flush_commits_stale_batch(tmp_path):
+    writer = ProfileArchiveWriter(str(tmp_path), batch_size=100, max_delay=0.1)
+    writer.append(ADA)
+
+    deadline = time.monotonic() + 5
+    rows = 0
+    while time.monotonic() < deadline and rows == 0:
+        time.sleep(0.05)
+        with ProfileArchiveReader(str(tmp_path)) as archive:
+            rows = len(archive)
+    # Committed by the flusher thread, not by close()
+    assert rows == 1
+    writer.close()
+
+
+def test_recovers_from_torn_commit_and_uncommitted_tails(tmp_path):
+    _write(tmp_path, ADA)
+
+    # Simulate a crash in the middle of the next batch
+    for name, junk in [
+        ("_commits", b"\x01"),
+        ("tech_stack.codes", b"\x01\x02\x03"),
+        ("tech_stack.dict", b'"Rust"\n'),
+        ("name.utf8", b"partial"),
+        ("experience_years.f64", b"\x00" * 8),
+    ]:
+        with open(os.path.join(tmp_path, name), "ab") as f:
+            f.write(junk)
+
+    with ProfileArchiveReader(str(tmp_path)) as archive:
+        assert len(archive) == 1
+
+    _write(tmp_path, GRACE)
+
+    with ProfileArchiveReader(str(tmp_path)) as archive:
+        assert len(archive) == 2
+        assert archive.dictionary("tech_stack") == ["Python", "Django", "Go"]
+        assert archive.count_by("tech_stack") == {"Python": 2, "Django": 1, "Go": 1}
+        assert [row["name"] for row in archive.iter_rows(["name"])] == ["Ada Lovelace", "Grace Hopper"]
+
+
+def test_second_writer_resyncs_dictionary(tmp_path):
+    first = ProfileArchiveWriter(str(tmp_path), max_delay=None)
+    second = ProfileArchiveWriter(str(tmp_path), max_delay=None)
+    first.append(ADA)
+    second.append({"name": "Alan Turing", "tech_stack": ["Go", "Python"]})
+    first.flush()
+    second.flush()
+
+    with ProfileArchiveReader(str(tmp_path)) as archive:
+        assert archive.dictionary("tech_stack") == ["Python", "Django", "Go"]
+        assert archive.count_by("tech_stack") == {"Python": 2, "Django": 1, "Go": 1}
+    first.close()
+    second.close()
+
+
+def test_invalid_record_is_rejected_without_breaking_the_writer(tmp_path):
+    writer = ProfileArchiveWriter(str(tmp_path), max_delay=None)
+    with pytest.raises(ValueError):
+        writer.append({**ADA, "experience_years": "abc"})
+    with pytest.raises(ValueError):
+        writer.append({**ADA, "tech_stack": "Python"})
+
+    writer.append(GRACE)
+    writer.close()
+
+    with ProfileArchiveReader(str(tmp_path)) as archive:
+        assert len(archive) == 1
@@ -0,0 +1,216 @@
+import json
+import os
+import time
+
+import pytest
+
+from utils.question_dedup import QuestionDeduplicator, dedup_question_output, parse_question_blocks
+
+
+def _index_files(tmp_path):
+    return sorted(name for name in os.listdir(tmp_path) if not name.endswith(".lock"))
+
+
+def _open(path, **kwargs):
+    return QuestionDeduplicator(str(path), background_merge=False, **kwargs)
+
+
+def test_filter_new_drops_near_duplicates(tmp_path):
+    index = QuestionDeduplicator(str(tmp_path / "index.bin"))
+    kept = index.filter_new([
+        "How do you handle exceptions in Python?",
+        "How do you handle exceptions in Python",
+        "Explain Django middleware.",
+    ])
+    assert kept == ["How do you handle exceptions in Python?", "Explain Django middleware."]
+    assert len(index) == 2
+    index.close()
+
+
+def test_save_and_reload_round_trip(tmp_path):
+    path = str(tmp_path / "index.bin")
+    writer = QuestionDeduplicator(path)
+    writer.filter_new(["Explain Django middleware.", "What is a Docker volume?"])
+    writer.save()
+    writer.close()
+
+    reader = QuestionDeduplicator(path)
+    assert len(reader) == 2
+    assert reader.is_duplicate("explain django middleware")
+    assert not reader.is_duplicate("How does Go schedule goroutines?")
+    reader.close()
+
+
+def test_refresh_sees_other_writer_and_merges(tmp_path):
+    path = str(tmp_path / "index.bin")
+    first = _open(path)
+    second = _open(path)
+
+    first.filter_new(["Explain Django middleware."])
+    second.filter_new(["What is a Docker volume?"])
+    first.save()
+    # second saves after first: its segment must not overwrite first's
+    second.save()
+
+    first.refresh()
+    assert len(first) == 2
+    assert first.is_duplicate("What is a Docker volume")
+    assert second.is_duplicate("Explain Django middleware")
+
+    # save() never merges; merge() folds the equal-sized segments into the base file
+    assert len(_index_files(tmp_path)) == 2
+    assert first.merge()
+    assert _index_files(tmp_path) == ["index.bin"]
+    second.refresh()
+    assert len(second) == 2
+    first.close()
+    second.close()
+
+
+def test_save_writes_segment_without_rewriting_base(tmp_path):
+    path = str(tmp_path / "index.bin")
+    index = _open(path)
+    index.filter_new([f"Question number {i} about topic {i * 7}" for i in range(20)])
+    index.save()
+    index.compact()
+    base_stat = os.stat(path)
+
+    index.filter_new(["Explain Django middleware."])
+    index.save()
+
+    assert os.stat(path).st_mtime_ns == base_stat.st_mtime_ns
+    assert len(_index_files(tmp_path)) == 2
+    assert len(index) == 21
+
+    # 20 vs 1 question keeps the size invariant, so nothing is merged
+    index.merge()
+    assert len(_index_files(tmp_path)) == 2
+
+    index.compact()
+    assert _index_files(tmp_path) == ["index.bin"]
+    reader = QuestionDeduplicator(path)
+    assert len(reader) == 21
+    assert reader.is_duplicate("Question number 3 about topic 21")
+    assert reader.is_duplicate("Explain Django middleware.")
+    reader.close()
+    index.close()
+
+
+def test_background_merge_after_save(tmp_path):
+    path = tmp_path / "index.bin"
+    index = QuestionDeduplicator(str(path))
+    for question in ["Explain Django middleware.", "What is a Docker volume?"]:
+        index.filter_new([question])
+        index.save()
+
+    deadline = time.monotonic() + 5
+    while _index_files(tmp_path) != ["index.bin"] and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert _index_files(tmp_path) == ["index.bin"]
+    index.close()
+
+
+def test_save_removes_covered_segments_and_temp_files(tmp_path):
+    path = tmp_path / "index.bin"
+    index = _open(path)
+    index.filter_new(["Explain Django middleware."])
+    index.save()
+    index.compact()
+
+    # Leftovers of a process that crashed mid-merge and mid-save
+    with open(path, "rb") as f:
+        (tmp_path / "index.bin.seg-0000000001-0000000001").write_bytes(f.read())
+    (tmp_path / "index.bin.tmp-save-abc").write_bytes(b"partial")
+    index.refresh()
+    assert len(index) == 1
+
+    index.filter_new(["What is a Docker volume?"])
+    index.save()
+    assert _index_files(tmp_path) == ["index.bin", "index.bin.seg-0000000002-0000000002"]
+    index.close()
+
+
+def test_corrupt_index_file_raises_value_error(tmp_path):
+    path = tmp_path / "index.bin"
+    path.write_bytes(b"TSQIDX02")
+    with pytest.raises(ValueError):
+        _open(path)
+
+
+def test_filter_question_blocks_reports_exhausted_technologies(tmp_path):
+    index = QuestionDeduplicator(str(tmp_path / "index.bin"))
+    index.add("How do you handle exceptions in Python?")
+    filtered, exhausted = index.filter_question_blocks([
+        {"technology": "Python", "questions": ["How do you handle exceptions in Python?"]},
+        {"technology": "Go", "questions": ["How does Go schedule goroutines?"]},
+    ])
+    assert filtered == [{"technology": "Go", "questions": ["How does Go schedule goroutines?"]}]
+    assert exhausted == ["Python"]
+    index.close()
+
+
+PYTHON_BLOCK = {"technology": "Python", "questions": ["How do you handle exceptions in Python?"]}
+GO_BLOCK = {"technology": "Go", "questions": ["How does Go schedule goroutines?"]}
+
+
+def _no_retry(technologies):
+    raise AssertionError("unexpected regeneration")
+
+
+def test_parse_question_blocks_shapes():
+    fenced = "```json\n" + json.dumps([PYTHON_BLOCK]) + "\n```"
+    assert parse_question_blocks(fenced) == [PYTHON_BLOCK]
+    assert parse_question_blocks(json.dumps(GO_BLOCK)) == [GO_BLOCK]
+    assert parse_question_blocks("I could not detect any valid technologies.") is None
+    assert parse_question_blocks('"just a string"') is None
+
+
+def test_dedup_output_filters_fenced_output(tmp_path):
+    index = _open(tmp_path / "index.bin")
+    raw = "```json\n" + json.dumps([PYTHON_BLOCK, GO_BLOCK]) + "\n```"
+    assert json.loads(dedup_question_output(index, raw, _no_retry)) == [PYTHON_BLOCK, GO_BLOCK]
+    assert index.is_duplicate(GO_BLOCK["questions"][0])
+    index.close()
+
+
+def test_dedup_output_regenerates_only_exhausted_technologies(tmp_path):
+    index = _open(tmp_path / "index.bin")
+    index.add(PYTHON_BLOCK["questions"][0])
+    requested = []
+
+    def regenerate(technologies):
+        requested.append(technologies)
+        return json.dumps([
+            {"technology": "python", "questions": ["When would you use a Python generator?"]},
+            {"technology": "Go", "questions": ["What is a Go channel used for?"]},
+        ])
+
+    output = json.loads(dedup_question_output(index, json.dumps([PYTHON_BLOCK, GO_BLOCK]), regenerate))
+    assert requested == [["Python"]]
+    assert output == [
+        {"technology": "python", "questions": ["When would you use a Python generator?"]},
+        GO_BLOCK,
+    ]
+    index.close()
+
+
+def test_dedup_output_falls_back_to_original_block(tmp_path):
+    index = _open(tmp_path / "index.bin")
+    raw = json.dumps([{"technology": "Python 3", "questions": PYTHON_BLOCK["questions"]}, GO_BLOCK])
+    dedup_question_output(index, raw, _no_retry)
+
+    # Second candidate: the retry repeats itself, then fails outright
+    for regenerate in (lambda technologies: raw, lambda technologies: 1 / 0):
+        output = json.loads(dedup_question_output(index, raw, regenerate))
+        assert [block["technology"] for block in output] == ["Python 3", "Go"]
+        assert output[0]["questions"] == PYTHON_BLOCK["questions"]
+    index.close()
+
+
+def test_dedup_output_keeps_raw_output_on_index_failure(tmp_path):
+    path = tmp_path / "index.bin"
+    index = _open(path)
+    path.write_bytes(b"not an index")
+    raw = json.dumps([PYTHON_BLOCK])
+    assert dedup_question_output(index, raw, _no_retry) == raw
+    assert dedup_question_output(index, "plain text", _no_retry) == "plain text"
@@ -0,0 +1,58 @@
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+
+def _try_lock(lock_file):
+    """Try once to take an exclusive lock. Returns True on success."""
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+
+def _unlock(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+    else:
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def file_lock(path, blocking=True, poll_interval=0.05):
+    """
+    Exclusive lock shared between processes, held on the file at `path`
+    (created if missing). Uses flock() on POSIX and msvcrt.locking() on
+    Windows.
+
+    Yields True once the lock is held. With blocking=False it yields False
+    immediately if another process holds the lock.
+    """
+    with open(path, "a+b") as lock_file:
+        if fcntl is not None and blocking:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        else:
+            while not _try_lock(lock_file):
+                if not blocking:
+                    yield False
+                    return
+                time.sleep(poll_interval)
+        try:
+            yield True
+        finally:
+            _unlock(lock_file)
@@ -0,0 +1,484 @@
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from collections import Counter
+
+from utils.file_lock import file_lock
+
+
+# Column types
+FLOAT = "float"          # float64 array, NaN for missing values
+STRING = "string"        # uint64 end offsets + utf-8 data
+DICT_LIST = "dict_list"  # uint64 end offsets + uint32 dictionary codes
+
+# Mirrors the profile shape in data/candidate_structure.json
+SCHEMA = [
+    ("name", STRING),
+    ("email", STRING),
+    ("phone", STRING),
+    ("experience_years", FLOAT),
+    ("desired_positions", DICT_LIST),
+    ("location", STRING),
+    ("tech_stack", DICT_LIST),
+    ("additional_notes", STRING),
+]
+COLUMN_TYPES = dict(SCHEMA)
+DICT_COLUMNS = [name for name, kind in SCHEMA if kind == DICT_LIST]
+
+COMMITS_FILE = "_commits"
+COMMIT_RECORD = struct.Struct(f"={1 + len(DICT_COLUMNS)}Q")
+
+
+def _column_files(name):
+    """Return the file names backing a column."""
+    kind = COLUMN_TYPES[name]
+    if kind == FLOAT:
+        return {"values": f"{name}.f64"}
+    if kind == STRING:
+        return {"offsets": f"{name}.off", "data": f"{name}.utf8"}
+    return {"offsets": f"{name}.off", "codes": f"{name}.codes", "dict": f"{name}.dict"}
+
+
+def _read_last_commit(path):
+    """
+    Return (rows, {dict_column: dictionary_size}) for the last complete
+    group commit, or zeros for an empty archive.
+    """
+    commits_path = os.path.join(path, COMMITS_FILE)
+    try:
+        size = os.path.getsize(commits_path)
+    except FileNotFoundError:
+        size = 0
+
+    complete = size - size % COMMIT_RECORD.size
+    if complete == 0:
+        return 0, {name: 0 for name in DICT_COLUMNS}
+
+    with open(commits_path, "rb") as f:
+        f.seek(complete - COMMIT_RECORD.size)
+        values = COMMIT_RECORD.unpack(f.read(COMMIT_RECORD.size))
+    return values[0], dict(zip(DICT_COLUMNS, values[1:]))
+
+
+def _coerce_record(profile):
+    """
+    Validate a profile against SCHEMA and convert it to storable values.
+    Raises ValueError before a bad record can enter a shared batch.
+    """
+    record = {}
+    for name, kind in SCHEMA:
+        value = profile.get(name)
+        if value is None:
+            record[name] = None
+        elif kind == FLOAT:
+            try:
+                record[name] = float(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"{name} must be a number, got {value!r}.") from None
+        elif kind == STRING:
+            record[name] = str(value)
+        else:
+            if not isinstance(value, (list, tuple)):
+                raise ValueError(f"{name} must be a list, got {value!r}.")
+            record[name] = [str(item) for item in value]
+    return record
+
+
+def _read_dictionary(file_path, size):
+    """Read the first `size` entries of a JSON-lines dictionary file."""
+    entries = []
+    if size == 0:
+        return entries
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line in f:
+            entries.append(json.loads(line))
+            if len(entries) == size:
+                break
+    return entries
+
+
+class ProfileArchiveWriter:
+    """
+    Append-only columnar archive for completed candidate profiles.
+
+    Each column lives in its own file(s) inside the archive directory,
+    stored in native byte order.
+    Records are buffered and written in batches (group commits): the column
+    files are appended and fsynced first, then one fixed-size record is
+    appended to the _commits file. Readers only trust rows covered by the
+    last commit record, so a crash mid-batch never exposes partial rows;
+    the next commit truncates any uncommitted tail before appending.
+
+    A background thread commits batches whose oldest record is older than
+    max_delay seconds, so records never wait for a later append().
+    """
+
+    def __init__(self, path, batch_size=256, max_delay=30.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+
+        self._lock = threading.Lock()
+        self._pending = []
+        self._oldest_pending = None
+
+        os.makedirs(path, exist_ok=True)
+
+        self._closed = threading.Event()
+        self._flusher = None
+        if max_delay is not None:
+            self._flusher = threading.Thread(
+                target=self._flush_stale, name="profile-archive-flush", daemon=True
+            )
+            self._flusher.start()
+
+    def append(self, profile):
+        """
+        Buffer a finished ConversationState.collected_data record.
+        The batch is committed once it reaches batch_size records or the
+        oldest buffered record is older than max_delay seconds.
+        Raises ValueError for a record that does not match SCHEMA.
+        """
+        record = _coerce_record(profile)
+        with self._lock:
+            self._pending.append(record)
+            if self._oldest_pending is None:
+                self._oldest_pending = time.monotonic()
+
+            if len(self._pending) >= self.batch_size or self._is_stale():
+                self._commit()
+
+    def flush(self):
+        """Commit every buffered record immediately."""
+        with self._lock:
+            self._commit()
+
+    def close(self):
+        """Stop the background flusher and commit buffered records."""
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # INTERNALS
+    def _is_stale(self):
+        return (
+            self.max_delay is not None
+            and self._oldest_pending is not None
+            and time.monotonic() - self._oldest_pending >= self.max_delay
+        )
+
+    def _flush_stale(self):
+        while not self._closed.wait(self.max_delay / 2):
+            with self._lock:
+                if not self._is_stale():
+                    continue
+                try:
+                    self._commit()
+                except OSError:
+                    # Records stay buffered; retried on the next tick
+                    pass
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _last_offset(self, file_name, rows):
+        """End offset of the last committed row in an offsets file."""
+        if rows == 0:
+            return 0
+        with open(self._file(file_name), "rb") as f:
+            f.seek((rows - 1) * 8)
+            return struct.unpack("=Q", f.read(8))[0]
+
+    def _truncate(self, file_name, size):
+        """Drop any bytes written after the last commit (size=None only creates the file)."""
+        file_path = self._file(file_name)
+        if not os.path.exists(file_path):
+            open(file_path, "wb").close()
+        if size is not None and os.path.getsize(file_path) != size:
+            with open(file_path, "r+b") as f:
+                f.truncate(size)
+
+    def _recover(self, rows, dict_sizes):
+        """
+        Truncate every column file to its last committed length and return
+        the committed end offsets and dictionaries.
+        """
+        ends = {}
+        dictionaries = {}
+
+        # A torn commit record would misalign every later one
+        self._truncate(COMMITS_FILE, None)
+        commits_size = os.path.getsize(self._file(COMMITS_FILE))
+        self._truncate(COMMITS_FILE, commits_size - commits_size % COMMIT_RECORD.size)
+
+        for name, kind in SCHEMA:
+            files = _column_files(name)
+            if kind == FLOAT:
+                self._truncate(files["values"], rows * 8)
+                continue
+
+            self._truncate(files["offsets"], rows * 8)
+            end = self._last_offset(files["offsets"], rows)
+            ends[name] = end
+
+            if kind == STRING:
+                self._truncate(files["data"], end)
+                continue
+
+            self._truncate(files["codes"], end * 4)
+            entries = _read_dictionary(self._file(files["dict"]), dict_sizes[name])
+            dict_bytes = sum(
+                len((json.dumps(e, ensure_ascii=False) + "\n").encode("utf-8")) for e in entries
+            )
+            self._truncate(files["dict"], dict_bytes)
+            dictionaries[name] = entries
+
+        return ends, dictionaries
+
+    def _commit(self):
+        if not self._pending:
+            return
+
+        records = self._pending
+        with file_lock(self._file(COMMITS_FILE + ".lock")):
+            # Re-read committed state: another process may have committed
+            rows, dict_sizes = _read_last_commit(self.path)
+            ends, dictionaries = self._recover(rows, dict_sizes)
+
+            written = []
+            try:
+                self._write_batch(records, ends, dictionaries, dict_sizes, written)
+                for fd in written:
+                    os.fsync(fd)
+            finally:
+                for fd in written:
+                    os.close(fd)
+
+            # The commit record is what makes the batch visible to readers
+            record = COMMIT_RECORD.pack(rows + len(records), *(dict_sizes[n] for n in DICT_COLUMNS))
+            fd = self._append(COMMITS_FILE, record)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+        self._pending = []
+        self._oldest_pending = None
+
+    def _write_batch(self, records, ends, dictionaries, dict_sizes, written):
+        """
+        Append one batch to every column file. Opened descriptors are added
+        to `written` so the caller can fsync and close them.
+        """
+        for name, kind in SCHEMA:
+            files = _column_files(name)
+            values = [record.get(name) for record in records]
+
+            if kind == FLOAT:
+                column = array("d", (math.nan if v is None else float(v) for v in values))
+                written.append(self._append(files["values"], column.tobytes()))
+            elif kind == STRING:
+                offsets = array("Q")
+                chunks = []
+                end = ends[name]
+                for value in values:
+                    encoded = ("" if value is None else str(value)).encode("utf-8")
+                    chunks.append(encoded)
+                    end += len(encoded)
+                    offsets.append(end)
+                written.append(self._append(files["data"], b"".join(chunks)))
+                written.append(self._append(files["offsets"], offsets.tobytes()))
+            else:
+                entries = dictionaries[name]
+                lookup = {value: code for code, value in enumerate(entries)}
+                new_entries = []
+                offsets = array("Q")
+                codes = array("I")
+                end = ends[name]
+                for value in values:
+                    # Each value counts once per profile
+                    for item in dict.fromkeys(value or []):
+                        code = lookup.get(item)
+                        if code is None:
+                            code = len(entries) + len(new_entries)
+                            lookup[item] = code
+                            new_entries.append(item)
+                        codes.append(code)
+                    end = len(codes) + ends[name]
+                    offsets.append(end)
+                dict_sizes[name] = len(entries) + len(new_entries)
+                written.append(self._append(
+                    files["dict"],
+                    "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in new_entries).encode("utf-8"),
+                ))
+                written.append(self._append(files["codes"], codes.tobytes()))
+                written.append(self._append(files["offsets"], offsets.tobytes()))
+
+    def _append(self, file_name, data):
+        fd = os.open(self._file(file_name), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+        except BaseException:
+            os.close(fd)
+            raise
+        return fd
+
+
+class ProfileArchiveReader:
+    """
+    Read-only, column-projected view of a profile archive.
+
+    Column files are memory-mapped on first use, so a query only touches the
+    files of the columns it asks for. The row count is fixed when the reader
+    is opened; open a new reader to see later commits.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.rows, self._dict_sizes = _read_last_commit(path)
+        self._maps = []
+        self._views = []
+        self._cache = {}
+
+    def __len__(self):
+        return self.rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # INTERNALS
+    def _map(self, file_name, fmt, length):
+        """Memory-map the first `length` items of a column file."""
+        if length == 0:
+            return memoryview(array(fmt))
+
+        with open(os.path.join(self.path, file_name), "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mm)
+
+        itemsize = struct.calcsize(fmt)
+        raw = memoryview(mm)
+        part = raw[:length * itemsize]
+        typed = part.cast(fmt) if fmt != "B" else part
+        self._views.extend([raw, part, typed])
+        return typed
+
+    def _offsets(self, name):
+        key = (name, "offsets")
+        if key not in self._cache:
+            self._cache[key] = self._map(_column_files(name)["offsets"], "Q", self.rows)
+        return self._cache[key]
+
+    @staticmethod
+    def _span(offsets, row):
+        start = offsets[row - 1] if row else 0
+        return start, offsets[row]
+
+    # COLUMN ACCESS
+    def values(self, name):
+        """
+        Memory-mapped float64 values of a FLOAT column (NaN = missing).
+        """
+        if COLUMN_TYPES.get(name) != FLOAT:
+            raise ValueError(f"Not a float column: {name}")
+        key = (name, "values")
+        if key not in self._cache:
+            self._cache[key] = self._map(_column_files(name)["values"], "d", self.rows)
+        return self._cache[key]
+
+    def codes(self, name):
+        """
+        Return (offsets, codes) for a DICT_LIST column.
+        Row i spans codes[offsets[i - 1]:offsets[i]] (start 0 for the first row).
+        """
+        if COLUMN_TYPES.get(name) != DICT_LIST:
+            raise ValueError(f"Not a dictionary-encoded column: {name}")
+        offsets = self._offsets(name)
+        key = (name, "codes")
+        if key not in self._cache:
+            end = offsets[self.rows - 1] if self.rows else 0
+            self._cache[key] = self._map(_column_files(name)["codes"], "I", end)
+        return offsets, self._cache[key]
+
+    def dictionary(self, name):
+        """Return the list of distinct values of a DICT_LIST column."""
+        if COLUMN_TYPES.get(name) != DICT_LIST:
+            raise ValueError(f"Not a dictionary-encoded column: {name}")
+        key = (name, "dict")
+        if key not in self._cache:
+            self._cache[key] = _read_dictionary(
+                os.path.join(self.path, _column_files(name)["dict"]), self._dict_sizes[name]
+            )
+        return self._cache[key]
+
+    def _string_data(self, name):
+        offsets = self._offsets(name)
+        key = (name, "data")
+        if key not in self._cache:
+            end = offsets[self.rows - 1] if self.rows else 0
+            self._cache[key] = self._map(_column_files(name)["data"], "B", end)
+        return offsets, self._cache[key]
+
+    def _value(self, name, row):
+        kind = COLUMN_TYPES[name]
+        if kind == FLOAT:
+            value = self.values(name)[row]
+            return None if math.isnan(value) else value
+        if kind == STRING:
+            offsets, data = self._string_data(name)
+            start, end = self._span(offsets, row)
+            return bytes(data[start:end]).decode("utf-8") or None
+        offsets, codes = self.codes(name)
+        entries = self.dictionary(name)
+        start, end = self._span(offsets, row)
+        return [entries[code] for code in codes[start:end]]
+
+    # QUERIES
+    def iter_rows(self, columns=None):
+        """
+        Yield profiles as dicts restricted to `columns` (all by default).
+        Only the requested columns are read.
+        """
+        columns = list(columns) if columns else [name for name, _ in SCHEMA]
+        unknown = [name for name in columns if name not in COLUMN_TYPES]
+        if unknown:
+            raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+
+        for row in range(self.rows):
+            yield {name: self._value(name, row) for name in columns}
+
+    def count_by(self, name):
+        """
+        Count profiles per value of a DICT_LIST column, e.g. count_by("tech_stack").
+        Scans only that column's code array.
+        """
+        _, codes = self.codes(name)
+        entries = self.dictionary(name)
+        counts = Counter(codes)
+        return {entries[code]: count for code, count in counts.most_common()}
+
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+        for mm in self._maps:
+            mm.close()
+        self._views = []
+        self._maps = []
+        self._cache = {}
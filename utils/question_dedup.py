@@ -0,0 +1,699 @@
+import bisect
+import hashlib
+import heapq
+import json
+import mmap
+import os
+import random
+import re
+import shutil
+import struct
+import tempfile
+import threading
+import zlib
+from array import array
+
+from utils.file_lock import file_lock
+
+
+class QuestionDeduplicator:
+    """
+    Near-duplicate detection for generated technical questions.
+
+    Each question is normalized, split into character shingles and reduced
+    to a MinHash signature. Signatures are indexed with LSH banding, so a
+    lookup only inspects the few questions sharing at least one band bucket
+    instead of scanning the whole corpus.
+
+    The index is a set of immutable runs: the base file at index_path plus
+    segment files named <index_path>.seg-<lo>-<hi>, where lo..hi is the
+    range of save() calls the run covers. Every run has the same layout,
+    header included, in native byte order (every section 8-byte aligned):
+        - header: magic, num_perm, bands, rows, count, lo, hi
+        - signatures: count * num_perm uint32
+        - for each band: count sorted uint64 bucket keys,
+          followed by count uint32 question ids
+
+    Runs are memory-mapped read-only, so every worker process shares the
+    same pages. Questions added at runtime live in a small in-memory delta
+    until save() writes them, and only them, as a new segment. merge()
+    then combines adjacent runs whenever a run is not more than twice the
+    size of the next newer one, so there are O(log n) runs and each
+    question is rewritten O(log n) times; a merge reaching the oldest run
+    becomes the new base file. By default merge() runs on a background
+    thread after each save(), outside the request path. Other workers pick
+    up changes with refresh().
+    """
+
+    MAGIC = b"TSQIDX02"
+    HEADER = struct.Struct("=8sIIIQQQ")
+    HEADER_SIZE = 48
+    # Bucket entries buffered per write while merging runs
+    MERGE_CHUNK = 65536
+
+    def __init__(self, index_path, num_perm=64, bands=16, shingle_size=5,
+                 threshold=0.8, seed=1, background_merge=True):
+        if num_perm % bands != 0:
+            raise ValueError("num_perm must be divisible by bands.")
+
+        self.index_path = index_path
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.threshold = threshold
+        self.background_merge = background_merge
+
+        # Universal hash family h(x) = (a * x + b) mod p, one pair per permutation
+        self._prime = (1 << 61) - 1
+        rng = random.Random(seed)
+        self._perms = [
+            (rng.randrange(1, self._prime), rng.randrange(0, self._prime))
+            for _ in range(num_perm)
+        ]
+
+        self._lock = threading.RLock()
+        self._runs = []
+        self._disk_state = None
+        self._lock_path = index_path + ".lock"
+        self._merge_lock_path = index_path + ".merge.lock"
+
+        self._merger = None
+        self._merge_requested = threading.Event()
+        self._closed = threading.Event()
+
+        # Questions added since the last save()
+        self._pending_sigs = []
+        self._pending_buckets = [{} for _ in range(bands)]
+
+        self.refresh()
+
+    # SIGNATURES
+    @staticmethod
+    def _normalize(text):
+        return " ".join(re.sub(r"[^\w\s]", " ", (text or "").lower()).split())
+
+    def _shingles(self, text):
+        normalized = self._normalize(text)
+        k = self.shingle_size
+        if len(normalized) <= k:
+            return {normalized} if normalized else set()
+        return {normalized[i:i + k] for i in range(len(normalized) - k + 1)}
+
+    def signature(self, text):
+        """
+        Return the MinHash signature of a question as a tuple of ints.
+        """
+        hashed = [zlib.crc32(s.encode("utf-8")) for s in self._shingles(text)]
+        if not hashed:
+            return None
+
+        prime = self._prime
+        return tuple(
+            min((a * x + b) % prime for x in hashed) & 0xFFFFFFFF
+            for a, b in self._perms
+        )
+
+    def _band_keys(self, sig):
+        keys = []
+        for band in range(self.bands):
+            chunk = sig[band * self.rows:(band + 1) * self.rows]
+            digest = hashlib.blake2b(
+                struct.pack(f"<{self.rows}I", *chunk), digest_size=8
+            ).digest()
+            keys.append(int.from_bytes(digest, "little"))
+        return keys
+
+    def _similarity(self, sig_a, sig_b):
+        matches = sum(1 for a, b in zip(sig_a, sig_b) if a == b)
+        return matches / self.num_perm
+
+    # LOOKUP
+    def _candidates(self, band_keys):
+        """
+        Yield signatures of indexed questions sharing a bucket in any band.
+        """
+        seen_runs = [set() for _ in self._runs]
+        seen_pending = set()
+
+        for band, key in enumerate(band_keys):
+            for run, seen in zip(self._runs, seen_runs):
+                for qid in run.lookup(band, key):
+                    if qid not in seen:
+                        seen.add(qid)
+                        yield run.signature(qid)
+
+            for idx in self._pending_buckets[band].get(key, ()):
+                if idx not in seen_pending:
+                    seen_pending.add(idx)
+                    yield self._pending_sigs[idx]
+
+    def _is_duplicate_sig(self, sig):
+        band_keys = self._band_keys(sig)
+        for candidate in self._candidates(band_keys):
+            if self._similarity(sig, candidate) >= self.threshold:
+                return True, band_keys
+        return False, band_keys
+
+    def is_duplicate(self, text):
+        """
+        True when a near-identical question has already been served.
+        """
+        sig = self.signature(text)
+        if sig is None:
+            return False
+        with self._lock:
+            return self._is_duplicate_sig(sig)[0]
+
+    def _add_sig(self, sig, band_keys):
+        idx = len(self._pending_sigs)
+        self._pending_sigs.append(sig)
+        for band, key in enumerate(band_keys):
+            self._pending_buckets[band].setdefault(key, []).append(idx)
+
+    def add(self, text):
+        """
+        Index a question as served, without a duplicate check.
+        """
+        sig = self.signature(text)
+        if sig is None:
+            return
+        with self._lock:
+            self._add_sig(sig, self._band_keys(sig))
+
+    def filter_new(self, questions):
+        """
+        Return the questions that are not near-duplicates of anything served
+        so far (or of each other), and index them as served.
+        """
+        kept = []
+        with self._lock:
+            for question in questions:
+                sig = self.signature(question)
+                if sig is None:
+                    continue
+                duplicate, band_keys = self._is_duplicate_sig(sig)
+                if not duplicate:
+                    self._add_sig(sig, band_keys)
+                    kept.append(question)
+        return kept
+
+    def filter_question_blocks(self, blocks):
+        """
+        Apply filter_new() to question blocks shaped as described in
+        prompts/questions.txt ({"technology": ..., "questions": [...]}).
+        Returns (filtered_blocks, exhausted_technologies), where the second
+        list names technologies whose questions were all duplicates.
+        """
+        filtered = []
+        exhausted = []
+        for block in blocks:
+            if not isinstance(block, dict) or not isinstance(block.get("questions"), list):
+                filtered.append(block)
+                continue
+            kept = self.filter_new([q for q in block["questions"] if isinstance(q, str)])
+            if kept:
+                filtered.append({**block, "questions": kept})
+            else:
+                exhausted.append(block.get("technology"))
+        return filtered, exhausted
+
+    def __len__(self):
+        return sum(run.count for run in self._runs) + len(self._pending_sigs)
+
+    # PERSISTENCE
+    def _segment_path(self, lo, hi):
+        return f"{self.index_path}.seg-{lo:010d}-{hi:010d}"
+
+    def _tmp_prefix(self, kind):
+        return f"{os.path.basename(self.index_path)}.tmp-{kind}-"
+
+    def _scan(self):
+        """
+        Snapshot of the files on disk: segment names are listed before the
+        base file is checked, so a concurrent merge is seen either before
+        or after, never half-applied.
+        """
+        directory = os.path.dirname(os.path.abspath(self.index_path))
+        pattern = re.compile(re.escape(os.path.basename(self.index_path)) + r"\.seg-(\d+)-(\d+)")
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            names = []
+        segments = tuple(sorted(
+            (int(m.group(1)), int(m.group(2)), os.path.join(directory, name))
+            for name in names
+            for m in [pattern.fullmatch(name)]
+            if m
+        ))
+        try:
+            stat = os.stat(self.index_path)
+            base = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            base = None
+        return base, segments
+
+    def _ranges(self, state):
+        """
+        (lo, hi, path) of every run file in a _scan() snapshot, reading the
+        base file's range from its header.
+        """
+        base, segments = state
+        ranges = list(segments)
+        if base is not None:
+            run = _IndexRun(self.index_path, self)
+            ranges.append((run.lo, run.hi, self.index_path))
+            run.close()
+        # Wider runs first (the base file on ties), so a run covered by an
+        # earlier one can be skipped
+        return sorted(ranges, key=lambda r: (r[0], -r[1], r[2] != self.index_path))
+
+    def _open_runs(self, state):
+        """
+        Map the runs of a _scan() snapshot, skipping segments already merged
+        into a wider run (those are deleted by the next save() or merge()).
+        """
+        runs = []
+        try:
+            covered = 0
+            for lo, hi, path in self._ranges(state):
+                if hi <= covered:
+                    continue
+                covered = hi
+                runs.append(_IndexRun(path, self))
+        except BaseException:
+            for run in runs:
+                run.close()
+            raise
+        return runs
+
+    def _remove_leftovers(self, include_merge_files=False):
+        """
+        Delete segments covered by a wider run and temporary files left by a
+        crashed process. The caller holds the index file lock, plus the
+        merge lock when include_merge_files is set.
+        """
+        directory = os.path.dirname(os.path.abspath(self.index_path))
+        prefixes = (self._tmp_prefix("save"),)
+        if include_merge_files:
+            prefixes += (self._tmp_prefix("merge"),)
+
+        obsolete = [
+            os.path.join(directory, name)
+            for name in os.listdir(directory)
+            if name.startswith(prefixes)
+        ]
+        covered = 0
+        for lo, hi, path in self._ranges(self._scan()):
+            if hi <= covered and path != self.index_path:
+                obsolete.append(path)
+            covered = max(covered, hi)
+
+        for path in obsolete:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _release(self):
+        for run in self._runs:
+            run.close()
+        self._runs = []
+        self._disk_state = None
+
+    def refresh(self):
+        """
+        Re-map the index files if another process has saved or merged.
+        Pending (unsaved) questions are kept.
+        """
+        with self._lock:
+            for _ in range(5):
+                state = self._scan()
+                if state == self._disk_state:
+                    return
+                try:
+                    runs = self._open_runs(state)
+                except FileNotFoundError:
+                    # A merge deleted a segment between listing and opening
+                    continue
+                self._release()
+                self._runs = runs
+                self._disk_state = state
+                return
+
+    @staticmethod
+    def _aligned(size):
+        return (size + 7) & ~7
+
+    def _run_size(self, count):
+        """Expected size in bytes of a run file holding `count` questions."""
+        band_size = self._aligned(count * 8) + self._aligned(count * 4)
+        return self.HEADER_SIZE + self._aligned(count * self.num_perm * 4) + self.bands * band_size
+
+    def _write_run(self, kind, lo, hi, runs, pending_sigs=(), pending_buckets=None):
+        """
+        Write `runs` (oldest first) followed by the pending questions as one
+        run file under a temporary name, and return that name. Runs are
+        streamed from their mappings in chunks, never loaded whole; the
+        caller swaps the file in with os.replace().
+        """
+        count = sum(run.count for run in runs) + len(pending_sigs)
+
+        directory = os.path.dirname(os.path.abspath(self.index_path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=self._tmp_prefix(kind))
+        try:
+            # mkstemp() creates 0600 files; workers may run as other users
+            os.chmod(tmp_path, 0o644)
+            with os.fdopen(fd, "wb") as out, tempfile.TemporaryFile(
+                dir=directory, prefix=self._tmp_prefix(kind)
+            ) as ids_out:
+                header = self.HEADER.pack(self.MAGIC, self.num_perm, self.bands, self.rows, count, lo, hi)
+                out.write(header.ljust(self.HEADER_SIZE, b"\0"))
+
+                for run in runs:
+                    out.write(run.sigs)
+                pending = array("I")
+                for sig in pending_sigs:
+                    pending.extend(sig)
+                out.write(pending)
+                self._pad(out, count * self.num_perm * 4)
+
+                for band in range(self.bands):
+                    sources = []
+                    offset = 0
+                    for run in runs:
+                        sources.append(_shifted(run.keys[band], run.ids[band], offset))
+                        offset += run.count
+                    if pending_buckets is not None:
+                        sources.append(sorted(
+                            (key, offset + idx)
+                            for key, indices in pending_buckets[band].items()
+                            for idx in indices
+                        ))
+
+                    # Keys go straight to the run file; ids wait in a side
+                    # file because the layout stores them after all keys
+                    ids_out.seek(0)
+                    ids_out.truncate()
+                    keys, ids = array("Q"), array("I")
+                    for key, qid in heapq.merge(*sources):
+                        keys.append(key)
+                        ids.append(qid)
+                        if len(keys) >= self.MERGE_CHUNK:
+                            out.write(keys)
+                            ids_out.write(ids)
+                            keys, ids = array("Q"), array("I")
+                    out.write(keys)
+                    ids_out.write(ids)
+                    self._pad(out, count * 8)
+
+                    ids_out.seek(0)
+                    shutil.copyfileobj(ids_out, out)
+                    self._pad(out, count * 4)
+
+                out.flush()
+                os.fsync(out.fileno())
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return tmp_path
+
+    def _pad(self, out, size):
+        out.write(b"\0" * (self._aligned(size) - size))
+
+    def save(self):
+        """
+        Write pending questions to disk as a new segment. Only the new
+        questions are written; combining segments is left to merge().
+        """
+        with self._lock:
+            if not self._pending_sigs:
+                return
+
+            with file_lock(self._lock_path):
+                self._remove_leftovers()
+                seq = max((hi for _, hi, _ in self._ranges(self._scan())), default=0) + 1
+                tmp_path = self._write_run(
+                    "save", seq, seq, [], self._pending_sigs, self._pending_buckets,
+                )
+                os.replace(tmp_path, self._segment_path(seq, seq))
+
+            self._pending_sigs = []
+            self._pending_buckets = [{} for _ in range(self.bands)]
+            self.refresh()
+
+        if self.background_merge:
+            self._request_merge()
+
+    def _merge_runs(self, runs):
+        """
+        Replace adjacent runs with a single run covering their range.
+        The new file is written without holding the index file lock, so
+        save() in other workers is never blocked by a long merge.
+        A run starting at the first save becomes the base file.
+        """
+        lo, hi = runs[0].lo, runs[-1].hi
+        path = self.index_path if lo == 1 else self._segment_path(lo, hi)
+        tmp_path = self._write_run("merge", lo, hi, runs)
+
+        with file_lock(self._lock_path):
+            os.replace(tmp_path, path)
+            self._remove_leftovers()
+        self.refresh()
+
+    def merge(self):
+        """
+        Merge adjacent runs until every run is more than twice the size of
+        the next newer one. Returns False without doing anything when
+        another process is already merging.
+        """
+        with file_lock(self._merge_lock_path, blocking=False) as acquired:
+            if not acquired:
+                return False
+            with file_lock(self._lock_path):
+                self._remove_leftovers(include_merge_files=True)
+
+            while True:
+                runs = self._open_runs(self._scan())
+                try:
+                    # Newest pair that breaks the size invariant, if any
+                    pair = next(
+                        (runs[i:i + 2] for i in range(len(runs) - 2, -1, -1)
+                         if runs[i].count <= 2 * runs[i + 1].count),
+                        None,
+                    )
+                    if pair is None:
+                        return True
+                    self._merge_runs(pair)
+                finally:
+                    for run in runs:
+                        run.close()
+
+    def compact(self):
+        """
+        Merge every run into the base file. Lookups never need this;
+        it only reduces the number of files to map.
+        """
+        with file_lock(self._merge_lock_path):
+            with file_lock(self._lock_path):
+                self._remove_leftovers(include_merge_files=True)
+            runs = self._open_runs(self._scan())
+            try:
+                if len(runs) > 1 or (runs and runs[0].path != self.index_path):
+                    self._merge_runs(runs)
+            finally:
+                for run in runs:
+                    run.close()
+
+    def _request_merge(self):
+        with self._lock:
+            if self._merger is None:
+                self._merger = threading.Thread(
+                    target=self._merge_loop, name="question-index-merge", daemon=True
+                )
+                self._merger.start()
+        self._merge_requested.set()
+
+    def _merge_loop(self):
+        while True:
+            self._merge_requested.wait()
+            if self._closed.is_set():
+                return
+            self._merge_requested.clear()
+            try:
+                self.merge()
+            except (OSError, ValueError):
+                # Retried after the next save()
+                pass
+
+    def close(self):
+        """Stop background merging and unmap the index files. Unsaved questions are discarded."""
+        self._closed.set()
+        self._merge_requested.set()
+        if self._merger is not None:
+            self._merger.join()
+        with self._lock:
+            self._release()
+
+
+def parse_question_blocks(raw_output):
+    """
+    Parse model output into a list of question blocks, or None.
+    The model often wraps its JSON in a ```json code fence.
+    """
+    text = (raw_output or "").strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        if text.rstrip().endswith("```"):
+            text = text.rstrip()[:-3]
+    try:
+        blocks = json.loads(text)
+    except (TypeError, ValueError):
+        return None
+    if isinstance(blocks, dict):
+        blocks = [blocks]
+    return blocks if isinstance(blocks, list) else None
+
+
+def _tech_key(block):
+    technology = block.get("technology") if isinstance(block, dict) else None
+    return " ".join(str(technology or "").lower().split())
+
+
+def dedup_question_output(index, raw_output, regenerate):
+    """
+    Drop questions already served to earlier candidates from model output.
+
+    Technologies whose questions were all duplicates are regenerated once
+    through regenerate(technology_names), which returns new model output.
+    A technology still without new questions keeps its original block:
+    repeated questions are better than none. Returns the filtered blocks
+    as JSON text, or raw_output unchanged if it cannot be parsed or the
+    index fails.
+    """
+    blocks = parse_question_blocks(raw_output)
+    if blocks is None:
+        return raw_output
+
+    try:
+        index.refresh()
+        filtered = []
+        for block in blocks:
+            kept, _ = index.filter_question_blocks([block])
+            filtered.append(kept[0] if kept else None)
+    except (OSError, ValueError):
+        return raw_output
+
+    exhausted = [
+        block for block, kept in zip(blocks, filtered)
+        if kept is None and _tech_key(block)
+    ]
+    retried = {}
+    if exhausted:
+        wanted = {_tech_key(block) for block in exhausted}
+        try:
+            retry_blocks = parse_question_blocks(
+                regenerate([str(block["technology"]) for block in exhausted])
+            ) or []
+            # Only the exhausted technologies; the others already have a block
+            for block in retry_blocks:
+                key = _tech_key(block)
+                if key in wanted and key not in retried:
+                    kept, _ = index.filter_question_blocks([block])
+                    if kept:
+                        retried[key] = kept[0]
+        except Exception:
+            # A failed retry must not cost the first generation
+            pass
+
+    output = [
+        kept or retried.get(_tech_key(block)) or block
+        for block, kept in zip(blocks, filtered)
+    ]
+
+    try:
+        index.save()
+    except (OSError, ValueError):
+        # Questions stay pending and are written by the next save()
+        pass
+
+    return json.dumps(output if len(output) > 1 else output[0], indent=2, ensure_ascii=False)
+
+
+def _shifted(keys, ids, offset):
+    """Yield (bucket key, question id) pairs of a run, renumbered by offset."""
+    for key, qid in zip(keys, ids):
+        yield key, qid + offset
+
+
+class _IndexRun:
+    """
+    One memory-mapped run file (the base file or a segment).
+    Raises ValueError if the file is not a complete, compatible run.
+    """
+
+    def __init__(self, path, index):
+        self.path = path
+        self.num_perm = index.num_perm
+
+        with open(path, "rb") as f:
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ValueError(f"Empty question index file: {path}") from None
+
+        if len(self._mmap) < index.HEADER_SIZE:
+            self._mmap.close()
+            raise ValueError(f"Truncated question index file: {path}")
+        magic, num_perm, bands, rows, count, lo, hi = index.HEADER.unpack_from(self._mmap, 0)
+        if magic != index.MAGIC or (num_perm, bands, rows) != (index.num_perm, index.bands, index.rows):
+            self._mmap.close()
+            raise ValueError(f"Incompatible question index: {path}")
+        if len(self._mmap) < index._run_size(count):
+            self._mmap.close()
+            raise ValueError(f"Truncated question index file: {path}")
+
+        self.count = count
+        self.lo = lo
+        self.hi = hi
+
+        view = memoryview(self._mmap)
+        self._views = [view]
+
+        def section(offset, size, fmt):
+            part = view[offset:offset + size]
+            typed = part.cast(fmt)
+            self._views.extend([part, typed])
+            return typed, offset + index._aligned(size)
+
+        offset = index.HEADER_SIZE
+        self.sigs, offset = section(offset, count * num_perm * 4, "I")
+        self.keys, self.ids = [], []
+        for _ in range(bands):
+            band_keys, offset = section(offset, count * 8, "Q")
+            band_ids, offset = section(offset, count * 4, "I")
+            self.keys.append(band_keys)
+            self.ids.append(band_ids)
+
+    def lookup(self, band, key):
+        """Yield ids of questions in the bucket `key` of `band`."""
+        keys = self.keys[band]
+        pos = bisect.bisect_left(keys, key)
+        while pos < self.count and keys[pos] == key:
+            yield self.ids[band][pos]
+            pos += 1
+
+    def signature(self, qid):
+        n = self.num_perm
+        return self.sigs[qid * n:(qid + 1) * n]
+
+    def close(self):
+        # Release order: typed views first, then slices, then the base view
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self.sigs = None
+        self.keys, self.ids = [], []
+        self._mmap.close()